@@ -6,46 +6,114 @@ Converts Shopify product export CSV files to Amazon's tab-delimited
 upload format based on the PAINT.xlsm template.
 """
 
+import codecs
 import csv
 import argparse
 import json
+from functools import lru_cache
 from pathlib import Path
 from html import unescape
 import re
+from operator import itemgetter
+
+try:
+    import orjson  # Optional: faster template loading (pip install orjson)
+except ImportError:
+    orjson = None
 
 # Path to template headers JSON (extracted from PAINT.xlsm)
 TEMPLATE_HEADERS_FILE = Path(__file__).parent / 'amazon_template_headers.json'
 
+# Precompiled patterns for HTML cleanup
+_LI_RE = re.compile(r'<li[^>]*>(.*?)</li>', re.IGNORECASE | re.DOTALL)
+_WS_RE = re.compile(r'\s+')
+
+# Bytes decoded at a time when checking the input CSV's encoding
+DECODE_CHUNK_BYTES = 64 * 1024
+
+# Size keyword -> Size value, checked in order against the title and option
+SIZE_NAMES = (
+    ('gallon', 'Gallon'),
+    ('quart', 'Quart'),
+)
+
+# Size keyword -> (Item Volume, Item Volume Unit, Size, Unit Count, Unit Count Type),
+# checked in order against the size, title and description
+VOLUMES = (
+    ('gallon', ('1', 'Gallons', '1 Gallon', '128', 'Fl Oz')),
+    ('quart', ('1', 'Quarts', '1 Quart', '32', 'Fl Oz')),
+    ('pint', ('1', 'Pints', '1 Pint', '16', 'Fl Oz')),
+)
+
 
+@lru_cache(maxsize=None)
 def load_template_headers():
-    """Load the Amazon template headers from JSON file."""
-    with open(TEMPLATE_HEADERS_FILE, 'r') as f:
-        return json.load(f)
+    """Load the Amazon template headers from JSON file.
 
+    Only the header rows written to the output are kept (the example row is
+    dropped), each padded/trimmed to the number of columns. The result is
+    cached, so treat it as read-only.
+    """
+    raw = TEMPLATE_HEADERS_FILE.read_bytes()
+    data = orjson.loads(raw) if orjson else json.loads(raw)
 
+    columns = data['columns']
+    num_cols = len(columns)
+    headers = {'columns': columns}
+    for key in ('settings', 'instructions', 'categories', 'attributes'):
+        row = data.get(key, [])
+        headers[key] = row[:num_cols] + [''] * (num_cols - len(row))
+    return headers
+
+
+@lru_cache(maxsize=4096)
 def strip_html(html_text):
     """Remove HTML tags and decode entities."""
     if not html_text:
         return ''
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', ' ', html_text)
+    # Remove HTML tags (anything matching <[^>]+>) in one linear scan, so an
+    # unclosed '<' can't make a regex rescan the rest of the body
+    parts = []
+    pos = 0
+    search = 0
+    while True:
+        start = html_text.find('<', search)
+        if start < 0:
+            break
+        if html_text.startswith('>', start + 1):
+            # '<>' is not a tag
+            search = start + 1
+            continue
+        end = html_text.find('>', start + 1)
+        if end < 0:
+            break
+        parts.append(html_text[pos:start])
+        parts.append(' ')
+        pos = search = end + 1
+    parts.append(html_text[pos:])
+    text = ''.join(parts)
     # Decode HTML entities
     text = unescape(text)
     # Normalize whitespace
-    text = ' '.join(text.split())
-    return text.strip()
+    return _WS_RE.sub(' ', text).strip()
 
 
 def extract_bullet_points(html_text, max_bullets=5):
     """Extract bullet points from HTML list items or create from description."""
+    # Variants share their parent's body, so cache per HTML string and hand
+    # back a fresh list since callers may fill in bullets themselves
+    return list(_extract_bullet_points(html_text, max_bullets))
+
+
+@lru_cache(maxsize=4096)
+def _extract_bullet_points(html_text, max_bullets):
     if not html_text:
-        return [''] * max_bullets
+        return ('',) * max_bullets
 
     bullets = []
 
     # Try to find list items
-    li_pattern = re.compile(r'<li[^>]*>(.*?)</li>', re.IGNORECASE | re.DOTALL)
-    matches = li_pattern.findall(html_text)
+    matches = _LI_RE.findall(html_text)
 
     if matches:
         for match in matches[:max_bullets]:
@@ -53,78 +121,95 @@ def extract_bullet_points(html_text, max_bullets=5):
             if bullet:
                 bullets.append(bullet)
 
-    # Pad with empty strings
-    while len(bullets) < max_bullets:
-        bullets.append('')
-
-    return bullets[:max_bullets]
-
-
-def read_shopify_csv(filepath):
-    """Read Shopify CSV and handle variant inheritance."""
-    products = []
-
-    # Try different encodings
-    for encoding in ['utf-8-sig', 'utf-8', 'cp1252', 'latin-1']:
-        try:
-            with open(filepath, 'r', encoding=encoding) as f:
-                reader = csv.DictReader(f)
-                rows = list(reader)
-            break
-        except UnicodeDecodeError:
-            continue
-    else:
-        raise ValueError(f"Could not decode {filepath} with any known encoding")
-
-    # Track parent product data for variants
-    parent_title = ''
-    parent_body = ''
-    parent_handle = ''
-    parent_vendor = ''
-    parent_type = ''
-    parent_tags = ''
-
-    for row in rows:
-        # If this row has a Title, it's a new parent product
-        if row.get('Title', '').strip():
-            parent_title = row.get('Title', '')
-            parent_body = row.get('Body (HTML)', '')
-            parent_handle = row.get('Handle', '')
-            parent_vendor = row.get('Vendor', '')
-            parent_type = row.get('Type', '')
-            parent_tags = row.get('Tags', '')
-
-        # Skip rows without SKU
-        sku = row.get('Variant SKU', '').strip()
-        if not sku:
-            continue
-
-        # Create product with inherited parent data
-        product = dict(row)
-        product['Variant SKU'] = sku
-        product['parent_title'] = parent_title
-        product['parent_body'] = parent_body
-        product['parent_handle'] = parent_handle
-        product['parent_vendor'] = parent_vendor
-        product['parent_type'] = parent_type
-        product['parent_tags'] = parent_tags
-
-        products.append(product)
-
-    return products
-
-
-def map_to_amazon(shopify_product, column_names):
-    """Map a Shopify product to Amazon template format."""
-
-    # Initialize all columns with empty strings
-    amazon_row = {col: '' for col in column_names}
+    # Pad with empty strings (at most max_bullets were collected above)
+    return tuple(bullets) + ('',) * (max_bullets - len(bullets))
+
+
+def detect_encoding(filepath, chunk_bytes=DECODE_CHUNK_BYTES):
+    """Pick the first encoding that decodes the whole file.
+
+    Each candidate is checked by running its incremental decoder over the raw
+    bytes chunk by chunk, so a non-ASCII byte deep in the file still moves us
+    on to the next encoding before anything is parsed.
+    """
+    with open(filepath, 'rb') as f:
+        # utf-8-sig also decodes plain utf-8, just without a BOM to strip
+        for encoding in ['utf-8-sig', 'cp1252']:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            f.seek(0)
+            try:
+                for chunk in iter(lambda: f.read(chunk_bytes), b''):
+                    decoder.decode(chunk)
+                decoder.decode(b'', final=True)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+
+    # latin-1 maps every byte, so it always decodes
+    return 'latin-1'
+
+
+def read_shopify_csv(filepath, encoding=None):
+    """Read Shopify CSV and handle variant inheritance.
+
+    Yields one product dict per variant row as the file is parsed. The
+    encoding is detected from the file when not given.
+    """
+    if encoding is None:
+        encoding = detect_encoding(filepath)
+    try:
+        with open(filepath, 'r', encoding=encoding) as f:
+            # Track parent product data for variants
+            parent_title = ''
+            parent_body = ''
+            parent_handle = ''
+            parent_vendor = ''
+            parent_type = ''
+            parent_tags = ''
+
+            for row in csv.DictReader(f):
+                # If this row has a Title, it's a new parent product
+                if row.get('Title', '').strip():
+                    parent_title = row.get('Title', '')
+                    parent_body = row.get('Body (HTML)', '')
+                    parent_handle = row.get('Handle', '')
+                    parent_vendor = row.get('Vendor', '')
+                    parent_type = row.get('Type', '')
+                    parent_tags = row.get('Tags', '')
+
+                # Skip rows without SKU
+                sku = row.get('Variant SKU', '').strip()
+                if not sku:
+                    continue
+
+                # Create product with inherited parent data
+                product = dict(row)
+                product['Variant SKU'] = sku
+                product['parent_title'] = parent_title
+                product['parent_body'] = parent_body
+                product['parent_handle'] = parent_handle
+                product['parent_vendor'] = parent_vendor
+                product['parent_type'] = parent_type
+                product['parent_tags'] = parent_tags
+
+                yield product
+    except UnicodeDecodeError:
+        raise ValueError(f"Could not decode {filepath} as {encoding}")
+
+
+def map_to_amazon(shopify_product):
+    """Map a Shopify product to Amazon template format.
+
+    Only the columns we fill are set; the writer leaves the rest empty.
+    """
+    amazon_row = {}
 
     # Build the Item Name from title + variant option
     title = shopify_product.get('parent_title', '') or shopify_product.get('Title', '')
+    title_lower = title.lower()
     option_value = shopify_product.get('Option1 Value', '').strip()
 
-    if option_value and option_value.lower() not in title.lower():
+    if option_value and option_value.lower() not in title_lower:
         item_name = f"{title} - {option_value}"
     else:
         item_name = title
@@ -149,10 +234,12 @@ def map_to_amazon(shopify_product, column_names):
 
     # Determine size from option or title
     size = shopify_product.get('Option1 Value', '')
-    if 'gallon' in title.lower() or 'gallon' in size.lower():
-        size = 'Gallon'
-    elif 'quart' in title.lower() or 'quart' in size.lower():
-        size = 'Quart'
+    size_lower = size.lower()
+    for keyword, size_name in SIZE_NAMES:
+        if keyword in title_lower or keyword in size_lower:
+            size = size_name
+            size_lower = keyword
+            break
 
     # Get image URLs
     main_image = shopify_product.get('Variant Image', '') or shopify_product.get('Image Src', '')
@@ -203,25 +290,12 @@ def map_to_amazon(shopify_product, column_names):
     amazon_row['Specific Uses for Product'] = 'Exterior'
 
     # Volume, Size, and Unit Count - derive from size, title, or description
-    size_text = f"{size} {title} {description}".lower()
-    if 'gallon' in size_text:
-        amazon_row['Item Volume'] = '1'
-        amazon_row['Item Volume Unit'] = 'Gallons'
-        amazon_row['Size'] = '1 Gallon'
-        amazon_row['Unit Count'] = '128'
-        amazon_row['Unit Count Type'] = 'Fl Oz'
-    elif 'quart' in size_text:
-        amazon_row['Item Volume'] = '1'
-        amazon_row['Item Volume Unit'] = 'Quarts'
-        amazon_row['Size'] = '1 Quart'
-        amazon_row['Unit Count'] = '32'
-        amazon_row['Unit Count Type'] = 'Fl Oz'
-    elif 'pint' in size_text:
-        amazon_row['Item Volume'] = '1'
-        amazon_row['Item Volume Unit'] = 'Pints'
-        amazon_row['Size'] = '1 Pint'
-        amazon_row['Unit Count'] = '16'
-        amazon_row['Unit Count Type'] = 'Fl Oz'
+    description_lower = description.lower()
+    for keyword, volume in VOLUMES:
+        if keyword in size_lower or keyword in title_lower or keyword in description_lower:
+            (amazon_row['Item Volume'], amazon_row['Item Volume Unit'], amazon_row['Size'],
+             amazon_row['Unit Count'], amazon_row['Unit Count Type']) = volume
+            break
     else:
         # Default for unknown sizes
         amazon_row['Unit Count'] = '1'
@@ -241,88 +315,163 @@ def map_to_amazon(shopify_product, column_names):
     return amazon_row, bullets
 
 
-def write_amazon_txt(products, bullets_list, output_path, template_headers):
-    """Write products to Amazon tab-delimited format with proper headers."""
+# Output file encoding expected by Amazon flat file uploads
+OUTPUT_ENCODING = 'cp1252'
+# Flush the row buffer to disk once it grows past this many bytes
+WRITE_CHUNK_BYTES = 64 * 1024
+
+# Characters that would break a tab-delimited row
+_CELL_TRANSLATION = str.maketrans({'\t': ' ', '\r': ' ', '\n': ' '})
+
+
+def clean_cell(value):
+    """Make a value safe to place in a tab-delimited cell."""
+    value = value.translate(_CELL_TRANSLATION)
+    if '"' in value:
+        # Quote the same way csv.writer did
+        value = '"' + value.replace('"', '""') + '"'
+    return value
+
+
+# Column plan opcodes: how a template column gets its value
+COL_FIELD = 0   # arg is a key into the mapped product dict
+COL_CONST = 1   # arg is the literal value
+COL_BULLET = 2  # arg is an index into the product's bullet points
+
+
+def build_column_plan(columns):
+    """Resolve each template column to an (opcode, arg) pair once per file.
+
+    The template repeats some column names (Bullet Point, Dangerous Goods
+    Regulations, GHS Class); their position-dependent values are fixed here
+    so rows don't need to track counters.
+    """
+    plan = []
+    bullet_idx = 0
+    ghs_idx = 0
+    dg_idx = 0  # Dangerous Goods Regulations index
+
+    for col_name in columns:
+        if col_name == 'Bullet Point':
+            # Handle multiple Bullet Point columns
+            plan.append((COL_BULLET, bullet_idx))
+            bullet_idx += 1
+        elif col_name == 'Dangerous Goods Regulations':
+            # Handle multiple Dangerous Goods columns: Other, GHS, GHS, GHS, GHS
+            if dg_idx == 0:
+                plan.append((COL_CONST, 'Other'))
+            elif dg_idx <= 4:
+                plan.append((COL_CONST, 'GHS'))
+            else:
+                plan.append((COL_CONST, ''))
+            dg_idx += 1
+        elif col_name == 'GHS Class':
+            # Handle multiple GHS Class columns
+            if ghs_idx == 0:
+                plan.append((COL_CONST, 'Amazon Specific No Label With Warning'))
+            elif ghs_idx == 1:
+                plan.append((COL_CONST, 'Irritant'))
+            else:
+                plan.append((COL_CONST, ''))
+            ghs_idx += 1
+        else:
+            plan.append((COL_FIELD, col_name))
+
+    return plan
+
+
+def compile_column_plan(plan):
+    """Compile a column plan into a blank row dict and a getter over it.
+
+    Every column gets a slot key in the blank row: its field name, or an
+    (opcode, position) tuple for constant and bullet columns. A data row is
+    then assembled without a per-column Python loop: copy the blank row,
+    update it with the product fields and bullets, and call the getter.
+
+    Returns (blank_row, row_getter, bullet_slots).
+    """
+    blank_row = {}
+    slots = []
+    bullet_slots = []
+
+    for position, (op, arg) in enumerate(plan):
+        if op == COL_FIELD:
+            slot = arg
+            blank_row[slot] = ''
+        elif op == COL_CONST:
+            slot = (COL_CONST, position)
+            blank_row[slot] = arg
+        else:
+            slot = (COL_BULLET, arg)
+            blank_row[slot] = ''
+            bullet_slots.append(slot)
+        slots.append(slot)
+
+    return blank_row, itemgetter(*slots), bullet_slots
+
+
+def write_amazon_txt(product_bullet_iter, output_path, template_headers):
+    """Write products to Amazon tab-delimited format with proper headers.
+
+    product_bullet_iter yields (amazon_row, bullets) pairs; each row is written
+    as soon as it is produced. Returns the number of data rows written.
+    """
 
     settings = template_headers['settings']
     instructions = template_headers['instructions']
     categories = template_headers['categories']
     columns = template_headers['columns']
     attributes = template_headers['attributes']
-    example_row = template_headers.get('example_row', [])
-    num_cols = len(columns)
 
-    # Ensure all header rows have exactly num_cols columns
-    while len(settings) < num_cols:
-        settings.append('')
-    while len(instructions) < num_cols:
-        instructions.append('')
-    while len(categories) < num_cols:
-        categories.append('')
-    while len(attributes) < num_cols:
-        attributes.append('')
-    while len(example_row) < num_cols:
-        example_row.append('')
-
-    with open(output_path, 'w', encoding='cp1252', newline='') as f:
-        # Write header rows directly (they already have proper quoting from template)
-        # Use CRLF line endings to match Amazon template
-        f.write('\t'.join(settings[:num_cols]) + '\r\n')
-        f.write('\t'.join(instructions[:num_cols]) + '\r\n')
-        f.write('\t'.join(categories[:num_cols]) + '\r\n')
-        f.write('\t'.join(columns[:num_cols]) + '\r\n')
-        f.write('\t'.join(attributes[:num_cols]) + '\r\n')
-
-        # Skip example row (ABC123) - not needed for upload
-
-        # Use csv writer for data rows (also needs CRLF)
-        writer = csv.writer(f, delimiter='\t', lineterminator='\r\n')
-
-        # Data rows
-        for product, bullets in zip(products, bullets_list):
-            row = []
-            bullet_idx = 0
-            ghs_idx = 0
-            dg_idx = 0  # Dangerous Goods Regulations index
-
-            for i, col_name in enumerate(columns):
-                if col_name == 'Bullet Point':
-                    # Handle multiple Bullet Point columns
-                    if bullet_idx < len(bullets):
-                        row.append(bullets[bullet_idx][:500] if bullets[bullet_idx] else '')
-                    else:
-                        row.append('')
-                    bullet_idx += 1
-                elif col_name == 'Dangerous Goods Regulations':
-                    # Handle multiple Dangerous Goods columns: Other, GHS, GHS, GHS, GHS
-                    if dg_idx == 0:
-                        row.append('Other')
-                    elif dg_idx <= 4:
-                        row.append('GHS')
-                    else:
-                        row.append('')
-                    dg_idx += 1
-                elif col_name == 'GHS Class':
-                    # Handle multiple GHS Class columns
-                    if ghs_idx == 0:
-                        row.append('Amazon Specific No Label With Warning')
-                    elif ghs_idx == 1:
-                        row.append('Irritant')
-                    else:
-                        row.append('')
-                    ghs_idx += 1
-                elif col_name in product:
-                    row.append(product[col_name])
-                else:
-                    row.append('')
-
-            # Ensure row has exactly num_cols columns
-            while len(row) < num_cols:
-                row.append('')
-
-            writer.writerow(row[:num_cols])
-
-    return len(products)
+    # Rows are joined and encoded by hand into a byte buffer that is flushed
+    # in large chunks, rather than going through csv.writer per cell
+    blank_row, row_getter, bullet_slots = compile_column_plan(build_column_plan(columns))
+    count = 0
+    buf = bytearray()
+
+    # Write straight to the output so symlinks, FIFOs and devices behave as
+    # before, but remove a regular file again if writing fails part way, so a
+    # truncated file never looks like a finished upload
+    target = Path(output_path).resolve()
+    try:
+        with open(output_path, 'wb') as f:
+            # Write header rows directly (they already have proper quoting from template)
+            # Use CRLF line endings to match Amazon template
+            for header_row in (settings, instructions, categories, columns, attributes):
+                buf += '\t'.join(header_row).encode(OUTPUT_ENCODING)
+                buf += b'\r\n'
+
+            # Skip example row (ABC123) - not needed for upload
+
+            # Data rows
+            separators = len(columns) - 1
+            for product, bullets in product_bullet_iter:
+                cells = blank_row.copy()
+                cells.update(product)
+                cells.update(zip(bullet_slots, [bullet[:500] for bullet in bullets]))
+                row = row_getter(cells)
+                line = '\t'.join(row)
+                # Check the joined line once instead of cleaning every cell; only
+                # rows with a stray tab, line break or quote take the slow path
+                if line.count('\t') != separators or '\r' in line or '\n' in line or '"' in line:
+                    line = '\t'.join(map(clean_cell, row))
+                # Append straight into the buffer; `encoded + b'\r\n'` would copy
+                # each row into a temporary bytes object first
+                buf += line.encode(OUTPUT_ENCODING)
+                buf += b'\r\n'
+                count += 1
+
+                if len(buf) >= WRITE_CHUNK_BYTES:
+                    f.write(buf)
+                    buf.clear()
+
+            f.write(buf)
+    except BaseException:
+        if target.is_file():
+            target.unlink()
+        raise
+
+    return count
 
 
 def main():
@@ -347,22 +496,16 @@ def main():
     columns = template_headers['columns']
     print(f"Template has {len(columns)} columns")
 
+    # Read, map and write in one pass so rows aren't all held in memory
     print(f"Reading Shopify CSV: {input_path}")
-    products = read_shopify_csv(input_path)
-    print(f"Found {len(products)} products/variants")
-
-    print("Mapping to Amazon format...")
-    amazon_products = []
-    bullets_list = []
-    for p in products:
-        amazon_row, bullets = map_to_amazon(p, columns)
-        amazon_products.append(amazon_row)
-        bullets_list.append(bullets)
-
-    print(f"Writing to: {output_path}")
-    count = write_amazon_txt(amazon_products, bullets_list, output_path, template_headers)
-
-    print(f"Done! Wrote {count} products to {output_path}")
+    print(f"Mapping to Amazon format and writing to: {output_path}")
+    # Settle the encoding before the output is opened, since the generator
+    # below only starts reading once the writer asks for rows
+    encoding = detect_encoding(input_path)
+    products = read_shopify_csv(input_path, encoding)
+    count = write_amazon_txt((map_to_amazon(p) for p in products), output_path, template_headers)
+
+    print(f"Done! Wrote {count} products/variants to {output_path}")
     print(f"File includes 5 header rows + {count} data rows")
     return 0
 
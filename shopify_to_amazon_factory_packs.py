@@ -6,18 +6,55 @@ Converts Shopify product export CSV files to Amazon's tab-delimited
 upload format with parent/child variation structure for factory pack paints.
 """
 
+import codecs
 import csv
 import argparse
 import json
 from pathlib import Path
-from html import unescape
 import re
-from collections import defaultdict
+import sys
+from functools import lru_cache
+from operator import itemgetter
 
 # Path to template headers JSON (extracted from PAINT.xlsm)
 TEMPLATE_HEADERS_FILE = Path(__file__).parent / 'amazon_template_headers.json'
 FACTORY_PACK_DESC_FILE = Path(__file__).parent / 'factory_pack_description.txt'
 
+# Bytes decoded at a time when checking the input CSV's encoding
+DECODE_CHUNK_BYTES = 64 * 1024
+
+# Color code patterns for titles, tried in order
+_COLOR_CODE_RES = [
+    re.compile(r'\b(WA\d+)\b', re.IGNORECASE),  # WA8624, WA636R, etc.
+    re.compile(r'\b([A-Z]{2}\d+)\b', re.IGNORECASE),  # PW7, PX8, UA, UH, RR, etc.
+    re.compile(r'\b(\d{3})\b', re.IGNORECASE),  # 040
+    re.compile(r'\b(\d[A-Z]\d)\b', re.IGNORECASE),  # 1F7
+]
+
+# Size keyword -> (Item Volume, Item Volume Unit, Size, Unit Count, Unit Count Type),
+# checked in order against the variant option
+VOLUMES = (
+    ('gallon', ('1', 'Gallons', '1 Gallon', '128', 'Fl Oz')),
+    ('quart', ('1', 'Quarts', '1 Quart', '32', 'Fl Oz')),
+    ('pint', ('1', 'Pints', '1 Pint', '16', 'Fl Oz')),
+)
+
+# Shopify columns the mappers read; other columns are not carried over, and
+# every product from read_shopify_csv has all of these plus the parent_* keys
+NEEDED_SHOPIFY_KEYS = (
+    'Title',
+    'Body (HTML)',
+    'Handle',
+    'Variant SKU',
+    'Variant Price',
+    'Variant Image',
+    'Image Src',
+    'Option1 Value',
+    'UPC (product.metafields.facts.upc)',
+    'color code (product.metafields.custom.color_code)',
+    'make (product.metafields.custom.make)',
+)
+
 # Related product ASINs for cross-references
 RELATED_PRODUCTS = {
     'clear_coat_kit': 'B0GCGHRP86',  # 2K 4:1 Clear Coat Kit
@@ -27,7 +64,12 @@ RELATED_PRODUCTS = {
 def load_template_headers():
     """Load the Amazon template headers from JSON file."""
     with open(TEMPLATE_HEADERS_FILE, 'r') as f:
-        return json.load(f)
+        template_headers = json.load(f)
+    # Intern column names: duplicates collapse to one object, and keys the
+    # mappers set as identifier-like literals ('SKU', 'Color', ...) become the
+    # same objects, so row dict lookups can match on identity
+    template_headers['columns'] = [sys.intern(col) for col in template_headers['columns']]
+    return template_headers
 
 
 def load_factory_pack_description():
@@ -41,60 +83,81 @@ def load_factory_pack_description():
     return ''
 
 
-def strip_html(html_text):
-    """Remove HTML tags and decode entities."""
-    if not html_text:
-        return ''
-    text = re.sub(r'<[^>]+>', ' ', html_text)
-    text = unescape(text)
-    text = ' '.join(text.split())
-    return text.strip()
+def detect_encoding(filepath, chunk_bytes=DECODE_CHUNK_BYTES):
+    """Pick the first encoding that decodes the whole file.
+
+    Each candidate is checked by running its incremental decoder over the raw
+    bytes chunk by chunk, so a non-ASCII byte deep in the file still moves us
+    on to the next encoding before anything is parsed.
+    """
+    with open(filepath, 'rb') as f:
+        # utf-8-sig also decodes plain utf-8, just without a BOM to strip
+        for encoding in ['utf-8-sig', 'cp1252']:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            f.seek(0)
+            try:
+                for chunk in iter(lambda: f.read(chunk_bytes), b''):
+                    decoder.decode(chunk)
+                decoder.decode(b'', final=True)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+
+    # latin-1 maps every byte, so it always decodes
+    return 'latin-1'
 
 
 def read_shopify_csv(filepath):
     """Read Shopify CSV and group variants by parent title (not handle, as handles can be duplicated)."""
-    product_families = defaultdict(list)
-
-    for encoding in ['utf-8-sig', 'utf-8', 'cp1252', 'latin-1']:
-        try:
-            with open(filepath, 'r', encoding=encoding) as f:
-                reader = csv.DictReader(f)
-                rows = list(reader)
-            break
-        except UnicodeDecodeError:
-            continue
-    else:
-        raise ValueError(f"Could not decode {filepath} with any known encoding")
-
-    parent_title = ''
-    parent_body = ''
-    parent_handle = ''
-    parent_color_code = ''
-    parent_make = ''
-
-    for row in rows:
-        if row.get('Title', '').strip():
-            parent_title = row.get('Title', '')
-            parent_body = row.get('Body (HTML)', '')
-            parent_handle = row.get('Handle', '')
-            parent_color_code = row.get('color code (product.metafields.custom.color_code)', '')
-            parent_make = row.get('make (product.metafields.custom.make)', '')
-
-        sku = row.get('Variant SKU', '').strip()
-        if not sku:
-            continue
-
-        product = dict(row)
-        product['Variant SKU'] = sku
-        product['parent_title'] = parent_title
-        product['parent_body'] = parent_body
-        product['parent_handle'] = parent_handle
-        product['parent_color_code'] = parent_color_code
-        product['parent_make'] = parent_make
-
-        # Group by title instead of handle to handle cases where
-        # different products share the same Shopify handle
-        product_families[parent_title].append(product)
+    product_families = {}
+
+    encoding = detect_encoding(filepath)
+    try:
+        with open(filepath, 'r', encoding=encoding) as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            num_fields = len(header)
+            # Resolve column positions once; later duplicates win, as with csv.DictReader
+            positions = {name: i for i, name in enumerate(header)}
+            present = [(key, positions[key]) for key in NEEDED_SHOPIFY_KEYS if key in positions]
+            blank_product = dict.fromkeys(NEEDED_SHOPIFY_KEYS, '')
+
+            parent_title = ''
+            parent_body = ''
+            parent_handle = ''
+            parent_color_code = ''
+            parent_make = ''
+
+            for row in reader:
+                if len(row) < num_fields:
+                    row += [''] * (num_fields - len(row))
+                product = blank_product.copy()
+                for key, i in present:
+                    product[key] = row[i]
+
+                if product['Title'].strip():
+                    parent_title = product['Title']
+                    parent_body = product['Body (HTML)']
+                    parent_handle = product['Handle']
+                    parent_color_code = product['color code (product.metafields.custom.color_code)']
+                    parent_make = product['make (product.metafields.custom.make)']
+
+                sku = product['Variant SKU'].strip()
+                if not sku:
+                    continue
+
+                product['Variant SKU'] = sku
+                product['parent_title'] = parent_title
+                product['parent_body'] = parent_body
+                product['parent_handle'] = parent_handle
+                product['parent_color_code'] = parent_color_code
+                product['parent_make'] = parent_make
+
+                # Group by title instead of handle to handle cases where
+                # different products share the same Shopify handle
+                product_families.setdefault(parent_title, []).append(product)
+    except UnicodeDecodeError:
+        raise ValueError(f"Could not decode {filepath} as {encoding}")
 
     return product_families
 
@@ -110,94 +173,115 @@ def create_parent_sku(handle, color_code=''):
     return f"SP-PARENT-{clean[:25].upper().replace('-', '')}"
 
 
+@lru_cache(maxsize=None)
 def extract_color_code_from_title(title):
     """Extract color code from title if not in metafield."""
-    import re
-    # Look for patterns like WA8624, PW7, 040, 1F7, etc.
-    patterns = [
-        r'\b(WA\d+)\b',  # WA8624, WA636R, etc.
-        r'\b([A-Z]{2}\d+)\b',  # PW7, PX8, UA, UH, RR, etc.
-        r'\b(\d{3})\b',  # 040
-        r'\b(\d[A-Z]\d)\b',  # 1F7
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, title, re.IGNORECASE)
+    for pattern in _COLOR_CODE_RES:
+        match = pattern.search(title)
         if match:
             return match.group(1).upper()
     return ''
 
 
-def map_parent_to_amazon(family_products, column_names, factory_description):
-    """Create a parent row for a product family."""
-    amazon_row = {col: '' for col in column_names}
+def build_base_row(description):
+    """Build the starting row shared by parent and child listings.
 
-    # Use first child's data for parent info
-    first_child = family_products[0]
-    title = first_child.get('parent_title', '') or first_child.get('Title', '')
-    color_code = first_child.get('parent_color_code', '')
-    make = first_child.get('parent_make', '')
+    Holds only the values that are the same on every row, so the mappers
+    copy it and set what varies. Rows stay sparse: columns that are never
+    set are left out and written as empty by write_amazon_txt.
+    """
+    base_row = {}
+
+    # Listing Identity
+    base_row['Listing Action'] = 'Create or Replace (Full Update)'
+
+    # Product Identity
+    base_row['Product Type'] = 'PAINT'
+    base_row['Brand Name'] = 'Spectral Paints'
+    base_row['Item Type Keyword'] = 'automotive-paints'
+    base_row['Manufacturer'] = 'Spectral Paints'
+
+    # Variation
+    base_row['Variation Theme Name'] = 'COLOR/SIZE'
+
+    # Product Details
+    base_row['Product Description'] = description
+    base_row['Coverage'] = '150-200 Square Feet'
+    base_row['Surface Recommendation'] = 'Metal'
+
+    # Safety & Compliance
+    base_row['Country of Origin'] = 'United States'
+    base_row['Are batteries required?'] = 'No'
+    base_row['Are batteries included?'] = 'No'
+    base_row['Safety Data Sheet (SDS or MSDS) URL'] = 'spectralpaints.biz'
 
-    # If no color code in metafield, try to extract from title
+    return base_row
+
+
+def get_color_code(shopify_product):
+    """Get a variant's color code from the metafield, or failing that the title."""
+    color_code = shopify_product['parent_color_code']
     if not color_code:
+        title = shopify_product['parent_title'] or shopify_product['Title']
         color_code = extract_color_code_from_title(title)
+    return color_code
+
+
+def map_parent_to_amazon(family_products, base_row, description):
+    """Create a parent row for a product family.
+
+    base_row comes from build_base_row; description is the factory pack
+    description, already capped for the Product Description column.
+    """
+    amazon_row = base_row.copy()
+
+    # Use first child's data for parent info
+    first_child = family_products[0]
+    title = first_child['parent_title'] or first_child['Title']
+    make = first_child['parent_make']
+    color_code = get_color_code(first_child)
 
     # Parent SKU - use color code if available for uniqueness
     parent_sku = create_parent_sku(first_child['parent_handle'], color_code)
 
     # Listing Identity
     amazon_row['SKU'] = parent_sku
-    amazon_row['Listing Action'] = 'Create or Replace (Full Update)'
 
     # Product Identity - Parent has minimal info
-    amazon_row['Product Type'] = 'PAINT'
     amazon_row['Item Name'] = title[:500]
-    amazon_row['Brand Name'] = 'Spectral Paints'
     amazon_row['Product Id Type'] = 'GTIN Exempt'  # Parent doesn't need UPC
-    amazon_row['Item Type Keyword'] = 'automotive-paints'
-    amazon_row['Manufacturer'] = 'Spectral Paints'
 
     # Variation - Parent settings
     amazon_row['Parentage Level'] = 'Parent'
     amazon_row['Parent SKU'] = ''  # Parent doesn't have a parent
-    amazon_row['Variation Theme Name'] = 'COLOR/SIZE'
 
     # Product Details
-    amazon_row['Product Description'] = factory_description[:2000]
     amazon_row['Color'] = color_code if color_code else 'Custom'
     amazon_row['Color Code'] = color_code if color_code else ''
 
-    # Product Details for parent
-    amazon_row['Coverage'] = '150-200 Square Feet'
-    amazon_row['Surface Recommendation'] = 'Metal'
-
-    # Safety & Compliance
-    amazon_row['Country of Origin'] = 'United States'
-    amazon_row['Are batteries required?'] = 'No'
-    amazon_row['Are batteries included?'] = 'No'
-    amazon_row['Safety Data Sheet (SDS or MSDS) URL'] = 'spectralpaints.biz'
-
     # Get main image from first variant
-    main_image = first_child.get('Variant Image', '') or first_child.get('Image Src', '')
+    main_image = first_child['Variant Image'] or first_child['Image Src']
     amazon_row['Main Image URL'] = main_image
 
     # Create bullet points from factory description
-    bullets = create_bullet_points(factory_description, make, color_code)
+    bullets = create_bullet_points(description, make, color_code)
 
     return amazon_row, bullets, parent_sku
 
 
-def map_child_to_amazon(shopify_product, column_names, parent_sku, factory_description):
-    """Map a Shopify product variant to Amazon child row."""
-    amazon_row = {col: '' for col in column_names}
+def map_child_to_amazon(shopify_product, base_row, parent_sku, description):
+    """Map a Shopify product variant to Amazon child row.
 
-    title = shopify_product.get('parent_title', '') or shopify_product.get('Title', '')
-    option_value = shopify_product.get('Option1 Value', '').strip()
-    color_code = shopify_product.get('parent_color_code', '')
-    make = shopify_product.get('parent_make', '')
+    base_row and description are as for map_parent_to_amazon.
+    """
+    amazon_row = base_row.copy()
 
-    # If no color code in metafield, try to extract from title
-    if not color_code:
-        color_code = extract_color_code_from_title(title)
+    title = shopify_product['parent_title'] or shopify_product['Title']
+    sku = shopify_product['Variant SKU']
+    option_value = shopify_product['Option1 Value'].strip()
+    # Read per variant: products that share a title are grouped into one
+    # family but can still carry different color codes
+    color_code = get_color_code(shopify_product)
 
     # Build item name with size
     if option_value:
@@ -206,32 +290,26 @@ def map_child_to_amazon(shopify_product, column_names, parent_sku, factory_descr
         item_name = title
 
     # Get UPC if available
-    upc = shopify_product.get('UPC (product.metafields.facts.upc)', '').strip()
+    upc = shopify_product['UPC (product.metafields.facts.upc)'].strip()
 
     # Get image
-    main_image = shopify_product.get('Variant Image', '') or shopify_product.get('Image Src', '')
+    main_image = shopify_product['Variant Image'] or shopify_product['Image Src']
 
     # Listing Identity
-    amazon_row['SKU'] = shopify_product.get('Variant SKU', '')
-    amazon_row['Listing Action'] = 'Create or Replace (Full Update)'
+    amazon_row['SKU'] = sku
 
     # Product Identity
-    amazon_row['Product Type'] = 'PAINT'
     amazon_row['Item Name'] = item_name[:500]
-    amazon_row['Brand Name'] = 'Spectral Paints'
     amazon_row['Product Id Type'] = 'UPC' if upc else 'GTIN Exempt'
     amazon_row['Product Id'] = upc
-    amazon_row['Item Type Keyword'] = 'automotive-paints'
-    amazon_row['Manufacturer'] = 'Spectral Paints'
 
     # Variation - Child settings
     amazon_row['Parentage Level'] = 'Child'
     amazon_row['Parent SKU'] = parent_sku
-    amazon_row['Variation Theme Name'] = 'COLOR/SIZE'
 
     # Offer
     amazon_row['Item Condition'] = 'New'
-    price = shopify_product.get('Variant Price', '')
+    price = shopify_product['Variant Price']
     amazon_row['List Price'] = price
     amazon_row['Your Price USD (Sell on Amazon, US)'] = price
 
@@ -242,59 +320,61 @@ def map_child_to_amazon(shopify_product, column_names, parent_sku, factory_descr
     amazon_row['Merchant Shipping Group (US)'] = 'Migrated Template'
 
     # Product Details
-    amazon_row['Product Description'] = factory_description[:2000]
     amazon_row['Number of Items'] = '1'
     amazon_row['Color'] = color_code if color_code else 'Custom'
     amazon_row['Color Code'] = color_code if color_code else ''
-    amazon_row['Part Number'] = shopify_product.get('Variant SKU', '')
-    amazon_row['Surface Recommendation'] = 'Metal'
-    amazon_row['Coverage'] = '150-200 Square Feet'
+    amazon_row['Part Number'] = sku
     amazon_row['Paint Type'] = 'Urethane'
     amazon_row['Finish Type'] = 'Metallic'
     amazon_row['Item Form'] = 'Liquid'
     amazon_row['Specific Uses for Product'] = 'Exterior'
 
     # Volume, Size, and Unit Count based on option value
-    size_lower = option_value.lower() if option_value else ''
-    if 'gallon' in size_lower:
-        amazon_row['Item Volume'] = '1'
-        amazon_row['Item Volume Unit'] = 'Gallons'
-        amazon_row['Size'] = '1 Gallon'
-        amazon_row['Unit Count'] = '128'
-        amazon_row['Unit Count Type'] = 'Fl Oz'
-    elif 'quart' in size_lower:
-        amazon_row['Item Volume'] = '1'
-        amazon_row['Item Volume Unit'] = 'Quarts'
-        amazon_row['Size'] = '1 Quart'
-        amazon_row['Unit Count'] = '32'
-        amazon_row['Unit Count Type'] = 'Fl Oz'
-    elif 'pint' in size_lower:
-        amazon_row['Item Volume'] = '1'
-        amazon_row['Item Volume Unit'] = 'Pints'
-        amazon_row['Size'] = '1 Pint'
-        amazon_row['Unit Count'] = '16'
-        amazon_row['Unit Count Type'] = 'Fl Oz'
+    size_lower = option_value.lower()
+    for keyword, volume in VOLUMES:
+        if keyword in size_lower:
+            (amazon_row['Item Volume'], amazon_row['Item Volume Unit'], amazon_row['Size'],
+             amazon_row['Unit Count'], amazon_row['Unit Count Type']) = volume
+            break
     else:
         amazon_row['Unit Count'] = '1'
         amazon_row['Unit Count Type'] = 'Count'
 
-    # Safety & Compliance
-    amazon_row['Country of Origin'] = 'United States'
-    amazon_row['Are batteries required?'] = 'No'
-    amazon_row['Are batteries included?'] = 'No'
-    amazon_row['Safety Data Sheet (SDS or MSDS) URL'] = 'spectralpaints.biz'
-
     # Images
     amazon_row['Main Image URL'] = main_image
 
-    # Create bullet points
-    bullets = create_bullet_points(factory_description, make, color_code)
+    # Create bullet points (cached, so children with the same make and color
+    # code share one tuple)
+    bullets = create_bullet_points(description, shopify_product['parent_make'], color_code)
 
     return amazon_row, bullets
 
 
+def process_family(variants, base_row, description):
+    """Map a product family to its parent row followed by its child rows.
+
+    Returns a list of (amazon_row, bullets) pairs.
+    """
+    # Create parent row
+    parent_row, parent_bullets, parent_sku = map_parent_to_amazon(
+        variants, base_row, description
+    )
+    rows = [(parent_row, parent_bullets)]
+
+    # Create child rows
+    for variant in variants:
+        rows.append(map_child_to_amazon(variant, base_row, parent_sku, description))
+
+    return rows
+
+
+@lru_cache(maxsize=None)
 def create_bullet_points(factory_description, make='', color_code=''):
-    """Create bullet points from factory description."""
+    """Create bullet points from factory description.
+
+    Cached, since every variant in a color family gets the same bullets;
+    returns a tuple so the shared result can't be modified.
+    """
     bullets = []
 
     # Split description into bullet points
@@ -322,7 +402,100 @@ def create_bullet_points(factory_description, make='', color_code=''):
     while len(bullets) < 5:
         bullets.append(' ')
 
-    return bullets[:5]
+    return tuple(bullets[:5])
+
+
+# Output file encoding expected by Amazon flat file uploads
+OUTPUT_ENCODING = 'cp1252'
+# Data rows are written to the output file in batches of this many rows
+WRITE_BATCH_ROWS = 1000
+# Buffer size for the output file
+WRITE_BUFFER_BYTES = 8 * 1024 * 1024
+
+# Characters that would break a tab-delimited row
+_CELL_TRANSLATION = str.maketrans({'\t': ' ', '\r': ' ', '\n': ' '})
+
+
+def clean_cell(value):
+    """Make a value safe to place in a tab-delimited cell."""
+    value = value.translate(_CELL_TRANSLATION)
+    if '"' in value:
+        # Quote the same way csv.writer did
+        value = '"' + value.replace('"', '""') + '"'
+    return value
+
+
+# Column plan opcodes: how a template column gets its value
+COL_FIELD = 0   # arg is a key into the product row
+COL_CONST = 1   # arg is the literal value
+COL_BULLET = 2  # arg is an index into the row's bullet points
+
+
+def build_column_plan(columns):
+    """Resolve each template column to an (opcode, arg) pair once per file.
+
+    Repeated Bullet Point, Dangerous Goods Regulations and GHS Class columns
+    get their position-dependent values here instead of per row.
+    """
+    plan = []
+    bullet_idx = 0
+    ghs_idx = 0
+    dg_idx = 0
+
+    for col_name in columns:
+        if col_name == 'Bullet Point':
+            plan.append((COL_BULLET, bullet_idx))
+            bullet_idx += 1
+        elif col_name == 'Dangerous Goods Regulations':
+            if dg_idx == 0:
+                plan.append((COL_CONST, 'Other'))
+            elif dg_idx <= 4:
+                plan.append((COL_CONST, 'GHS'))
+            else:
+                plan.append((COL_CONST, ''))
+            dg_idx += 1
+        elif col_name == 'GHS Class':
+            if ghs_idx == 0:
+                plan.append((COL_CONST, 'Amazon Specific No Label With Warning'))
+            elif ghs_idx == 1:
+                plan.append((COL_CONST, 'Irritant'))
+            else:
+                plan.append((COL_CONST, ''))
+            ghs_idx += 1
+        else:
+            plan.append((COL_FIELD, col_name))
+
+    return plan
+
+
+def compile_column_plan(plan):
+    """Compile a column plan into a blank row dict and a getter over it.
+
+    Every column gets a slot key: its field name, or an (opcode, position)
+    tuple for constant and bullet columns. A row is then built without a
+    per-column Python loop by copying the blank row, updating it with the
+    product and bullets, and calling the getter.
+
+    Returns (blank_row, row_getter, bullet_slots).
+    """
+    blank_row = {}
+    slots = []
+    bullet_slots = []
+
+    for position, (op, arg) in enumerate(plan):
+        if op == COL_FIELD:
+            slot = arg
+            blank_row[slot] = ''
+        elif op == COL_CONST:
+            slot = (COL_CONST, position)
+            blank_row[slot] = arg
+        else:
+            slot = (COL_BULLET, arg)
+            blank_row[slot] = ''
+            bullet_slots.append(slot)
+        slots.append(slot)
+
+    return blank_row, itemgetter(*slots), bullet_slots
 
 
 def write_amazon_txt(products, bullets_list, output_path, template_headers):
@@ -335,56 +508,35 @@ def write_amazon_txt(products, bullets_list, output_path, template_headers):
     num_cols = len(columns)
 
     # Pad header rows
-    for header_list in [settings, instructions, categories, attributes]:
-        while len(header_list) < num_cols:
-            header_list.append('')
-
-    with open(output_path, 'w', encoding='cp1252', newline='') as f:
-        f.write('\t'.join(settings[:num_cols]) + '\r\n')
-        f.write('\t'.join(instructions[:num_cols]) + '\r\n')
-        f.write('\t'.join(categories[:num_cols]) + '\r\n')
-        f.write('\t'.join(columns[:num_cols]) + '\r\n')
-        f.write('\t'.join(attributes[:num_cols]) + '\r\n')
-
-        writer = csv.writer(f, delimiter='\t', lineterminator='\r\n')
-
+    for header_list in (settings, instructions, categories, attributes):
+        header_list.extend([''] * (num_cols - len(header_list)))
+
+    # Binary output: lines are encoded here in batches, skipping the text
+    # layer's per-write encoding, and the large buffer coalesces the writes
+    with open(output_path, 'wb', buffering=WRITE_BUFFER_BYTES) as f:
+        for header_row in (settings, instructions, categories, columns, attributes):
+            f.write(('\t'.join(header_row[:num_cols]) + '\r\n').encode(OUTPUT_ENCODING))
+
+        blank_row, row_getter, bullet_slots = compile_column_plan(build_column_plan(columns))
+        separators = num_cols - 1
+        lines = []
         for product, bullets in zip(products, bullets_list):
-            row = []
-            bullet_idx = 0
-            ghs_idx = 0
-            dg_idx = 0
-
-            for i, col_name in enumerate(columns):
-                if col_name == 'Bullet Point':
-                    if bullet_idx < len(bullets):
-                        row.append(bullets[bullet_idx][:500] if bullets[bullet_idx] else '')
-                    else:
-                        row.append('')
-                    bullet_idx += 1
-                elif col_name == 'Dangerous Goods Regulations':
-                    if dg_idx == 0:
-                        row.append('Other')
-                    elif dg_idx <= 4:
-                        row.append('GHS')
-                    else:
-                        row.append('')
-                    dg_idx += 1
-                elif col_name == 'GHS Class':
-                    if ghs_idx == 0:
-                        row.append('Amazon Specific No Label With Warning')
-                    elif ghs_idx == 1:
-                        row.append('Irritant')
-                    else:
-                        row.append('')
-                    ghs_idx += 1
-                elif col_name in product:
-                    row.append(product[col_name])
-                else:
-                    row.append('')
-
-            while len(row) < num_cols:
-                row.append('')
-            writer.writerow(row[:num_cols])
+            cells = blank_row.copy()
+            cells.update(product)
+            cells.update(zip(bullet_slots, [bullet[:500] for bullet in bullets]))
+            row = row_getter(cells)
+            line = '\t'.join(row)
+            # Only rows with a stray tab, line break or quote need cleaning
+            if line.count('\t') != separators or '\r' in line or '\n' in line or '"' in line:
+                line = '\t'.join(map(clean_cell, row))
+            lines.append(line)
+
+            if len(lines) >= WRITE_BATCH_ROWS:
+                f.write(('\r\n'.join(lines) + '\r\n').encode(OUTPUT_ENCODING))
+                lines.clear()
+
+        if lines:
+            f.write(('\r\n'.join(lines) + '\r\n').encode(OUTPUT_ENCODING))
 
     return len(products)
 
@@ -424,24 +576,15 @@ def main():
     print(f"Found {len(product_families)} product families")
 
     print("Mapping to Amazon format with parent/child variations...")
+    product_description = factory_description[:2000]
+    base_row = build_base_row(product_description)
     amazon_products = []
     bullets_list = []
 
-    for handle, variants in product_families.items():
-        # Create parent row
-        parent_row, parent_bullets, parent_sku = map_parent_to_amazon(
-            variants, columns, factory_description
-        )
-        amazon_products.append(parent_row)
-        bullets_list.append(parent_bullets)
-
-        # Create child rows
-        for variant in variants:
-            child_row, child_bullets = map_child_to_amazon(
-                variant, columns, parent_sku, factory_description
-            )
-            amazon_products.append(child_row)
-            bullets_list.append(child_bullets)
+    for variants in product_families.values():
+        for amazon_row, bullets in process_family(variants, base_row, product_description):
+            amazon_products.append(amazon_row)
+            bullets_list.append(bullets)
 
     print(f"Writing to: {output_path}")
     count = write_amazon_txt(amazon_products, bullets_list, output_path, template_headers)